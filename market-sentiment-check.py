@@ -3,7 +3,7 @@
 # This script is designed to fetch the latest market sentiment article, analyze its sentiment,
 # and log the results. It also sends a push notification with the sentiment analysis.
 # Ensure you have the required packages installed:
-# pip install requests beautifulsoup4 python-dotenv openai anthropic
+# pip install requests lxml python-dotenv openai anthropic
 # Make sure to set the environment variables in a .env file or your system environment.
 # The script will log messages based on the configured log level and send notifications via Pushover.
 # The script will retry fetching the article if it has not been updated today.
@@ -14,19 +14,35 @@
 # Make sure to test the script in a controlled environment before deploying it in production.
 # The script is intended for educational purposes and should be used responsibly.
 
+import atexit
 import os
 import requests
 import hashlib
 import csv
+import json
 import re
 import time
-from bs4 import BeautifulSoup
+from lxml import etree as lxml_etree
+from lxml import html as lxml_html
 from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Matches the publish marker directly in the raw HTML bytes: group(2) is the
+# short date used for comparison ('April 17, 2025'), group(1) the full display
+# string up to the next tag ('April 17, 2025, 9:15 a.m. ET').
+PUBLISHED_RE = re.compile(rb"Published as of:(?:\s|&nbsp;)*(([A-Za-z]+ \d{1,2}, \d{4})[^<]*)")
+
+# Static analyst instructions, shared by both providers. Kept out of the
+# per-request user content so the stable prefix is cacheable on Anthropic.
+ANALYST_SYSTEM = """You are a financial analyst. Based on the following article, determine whether the market sentiment for today is bullish, bearish, or mixed.
+Respond with only one word: Bullish, Bearish, or Mixed at the start,  followed by 2-3 key indicators that explain your reasoning."""
+
+OPENAI_MODEL = "gpt-4"
+ANTHROPIC_MODEL = "claude-opus-4-20250514"
+
 USE_MODEL = os.getenv("USE_MODEL", "openai")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
@@ -34,6 +50,22 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 PUSHOVER_USER_KEY = os.getenv("PUSHOVER_USER_KEY")
 PUSHOVER_API_TOKEN = os.getenv("PUSHOVER_API_TOKEN")
 
+# Log levels are fixed for the process lifetime; resolve them once instead of
+# rebuilding the dict on every log_message call.
+_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30}
+_CURRENT_LEVEL = _LEVELS.get(LOG_LEVEL.upper(), 20)
+
+# Single buffered handle for the whole run instead of an open/write/close
+# cycle (3 syscalls) per log line. stdio buffering coalesces writes; the
+# handle is flushed on WARNING and above and closed (flushing) at exit.
+_LOG_FH = open("market_sentiment_debug.log", "a", buffering=8192, encoding="utf-8")
+atexit.register(_LOG_FH.close)
+
+# One pooled session for all HTTP calls: the retry path re-fetches the same
+# host, and reusing the connection skips a DNS lookup and TLS handshake.
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+
 if USE_MODEL == "openai" and OPENAI_API_KEY:
     import openai
     openai.api_key = OPENAI_API_KEY
@@ -43,14 +75,26 @@ elif USE_MODEL == "anthropic" and ANTHROPIC_API_KEY:
 else:
     raise ValueError("Missing or invalid API configuration.")
 
-def log_message(level, message, debug_file="market_sentiment_debug.log"):
-    levels = {"DEBUG": 10, "INFO": 20, "WARNING": 30}
-    current_level = levels.get(LOG_LEVEL.upper(), 20)
-    message_level = levels.get(level.upper(), 100)
-    if message_level >= current_level:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(debug_file, "a") as log:
-            log.write(f"[{level.upper()}] {timestamp} — {message}\n")
+# strftime is surprisingly costly in CPython; log lines only carry second
+# resolution, so cache the formatted stamp until the clock ticks over.
+_LAST_TS_SEC = 0
+_LAST_TS_STR = ""
+
+def _log_timestamp():
+    global _LAST_TS_SEC, _LAST_TS_STR
+    now_sec = int(time.time())
+    if now_sec != _LAST_TS_SEC:
+        n = datetime.now()
+        _LAST_TS_SEC = now_sec
+        _LAST_TS_STR = f"{n.year:04d}-{n.month:02d}-{n.day:02d} {n.hour:02d}:{n.minute:02d}:{n.second:02d}"
+    return _LAST_TS_STR
+
+def log_message(level, message):
+    message_level = _LEVELS.get(level.upper(), 100)
+    if message_level >= _CURRENT_LEVEL:
+        _LOG_FH.write(f"[{level.upper()}] {_log_timestamp()} — {message}\n")
+        if message_level >= _LEVELS["WARNING"]:
+            _LOG_FH.flush()
 
 def send_push_notification(message):
     if not PUSHOVER_USER_KEY or not PUSHOVER_API_TOKEN:
@@ -62,112 +106,236 @@ def send_push_notification(message):
         "user": PUSHOVER_USER_KEY,
         "message": message
     }
-    response = requests.post("https://api.pushover.net/1/messages.json", data=payload)
+    response = SESSION.post("https://api.pushover.net/1/messages.json", data=payload, timeout=10)
     if response.status_code != 200:
         log_message("WARNING", f"Pushover notification failed: {response.text}")
     else:
         log_message("INFO", "Push notification sent successfully.")
 
+def load_etag_headers(filename="article_etag.json"):
+    if os.path.isfile(filename):
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log_message("WARNING", f"Could not read etag sidecar, refetching: {e}")
+    return {}
+
+def save_etag_headers(headers, filename="article_etag.json"):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(headers, f, indent=2)
+
 def fetch_article():
     url = "https://www.schwab.com/learn/story/stock-market-update-open"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(url, headers=headers)
-    # Save response to a file for debugging
-    with open("article_html.log", "w", encoding="utf-8") as f:
-        f.write(response.text)
-    return response.text
-
-def extract_article_text(html):
-    soup = BeautifulSoup(html, "html.parser")
-    paragraphs = soup.find_all("p")
-    article_text = "\n".join(p.get_text() for p in paragraphs if p.get_text().strip())
-    # Save response to a file for debugging
-    with open("article.log", "w", encoding="utf-8") as f:
-        f.write(article_text)
+    # Send the validators from the previous fetch; a 304 means the page is
+    # byte-identical and the whole parse/LLM pipeline can be skipped.
+    cached = load_etag_headers()
+    conditional = {}
+    if cached.get("etag"):
+        conditional["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        conditional["If-Modified-Since"] = cached["last_modified"]
+    # Stream the body and hand back the raw bytes; response.text would build
+    # a second, decoded copy of the whole page that nothing downstream needs.
+    with SESSION.get(url, timeout=10, stream=True, headers=conditional) as response:
+        if response.status_code == 304:
+            return None
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["etag"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["last_modified"] = response.headers["Last-Modified"]
+        if validators:
+            save_etag_headers(validators)
+        return response.content
+
+def dump_html(html_bytes):
+    # Save response to a file when debugging; the dump costs a full page write.
+    if _CURRENT_LEVEL <= _LEVELS["DEBUG"]:
+        with open("article_html.log", "wb") as f:
+            f.write(html_bytes)
+
+def parse_html(html_bytes):
+    # Parse with lxml directly: both the tree build and text extraction run
+    # at C level, without BeautifulSoup's Python-side node wrappers.
+    try:
+        return lxml_html.fromstring(html_bytes)
+    except lxml_etree.ParserError:
+        # Empty or unparseable body: hand back an empty tree so the run falls
+        # through to the publish-date check and its retry path.
+        log_message("WARNING", "Fetched page could not be parsed; treating as empty.")
+        return lxml_html.fromstring(b"<html></html>")
+
+def extract_article_text(tree):
+    # The normalize-space() predicate drops blank paragraphs inside libxml2,
+    # so selection, filtering and text_content() all run at C level. The
+    # Python-side filter stays only for what XPath's ASCII notion of space
+    # misses (e.g. &nbsp;-only paragraphs).
+    paragraphs = tree.xpath("//p[normalize-space()]")
+    article_text = "\n".join(t for p in paragraphs if (t := p.text_content().strip()))
+    # Save the extracted text when debugging; the dump costs a full write per run.
+    if _CURRENT_LEVEL <= _LEVELS["DEBUG"]:
+        with open("article.log", "w", encoding="utf-8") as f:
+            f.write(article_text)
     return article_text
 
-def extract_publish_datetime(html):
-    soup = BeautifulSoup(html, "html.parser")
-    match = soup.find(string=re.compile("Published as of:"))
+def extract_publish_datetime(html_bytes):
+    # The marker is literal text, so scan the raw HTML directly instead of
+    # walking a parsed tree: one regex pass replaces an entire second parse.
+    match = PUBLISHED_RE.search(html_bytes)
     if match:
-        # Step 1: Extract resilient short date for comparison (e.g., 'April 17, 2025')
-        short_date_match = re.search(r"Published as of: ([A-Za-z]+ \d{1,2}, \d{4})", match)
-        # Step 2: Extract full raw date string for push notification (e.g., 'April 17, 2025, 9:15 a.m. ET')
-        full_date_match = re.search(r"Published as of: (.+)", match)
-        log_message("DEBUG", f"Extracted full date text: {full_date_match.group(1) if full_date_match else 'None'}")
-        if short_date_match and full_date_match:
-            try:
-                short_clean_str = short_date_match.group(1).strip()
-                short_dt = datetime.strptime(short_clean_str, "%B %d, %Y")
-                log_message("DEBUG", f"Parsed short date: {short_dt}")
-                return short_dt.strftime("%Y-%m-%d"), full_date_match.group(1)
-            except ValueError as e:
-                log_message("ERROR", f"Failed parsing short datetime: {e}")
+        # group(2): resilient short date for comparison (e.g., 'April 17, 2025')
+        # group(1): full raw date string for push notification (e.g., 'April 17, 2025, 9:15 a.m. ET')
+        full_date_str = match.group(1).decode("utf-8", errors="replace").strip()
+        log_message("DEBUG", f"Extracted full date text: {full_date_str}")
+        try:
+            short_dt = datetime.strptime(match.group(2).decode("ascii"), "%B %d, %Y")
+            log_message("DEBUG", f"Parsed short date: {short_dt}")
+            return short_dt.strftime("%Y-%m-%d"), full_date_str
+        except ValueError as e:
+            log_message("ERROR", f"Failed parsing short datetime: {e}")
     raise ValueError("Could not extract publish date from article.")
 
 def get_article_hash(text):
-    return hashlib.md5(text.encode()).hexdigest()
-
-def get_sentiment(article):
-    prompt = f"""
-You are a financial analyst. Based on the following article, determine whether the market sentiment for today is bullish, bearish, or mixed.
-Respond with only one word: Bullish, Bearish, or Mixed at the start,  followed by 2-3 key indicators that explain your reasoning.
+    # BLAKE2b is faster than MD5 on modern CPUs; 16 bytes keeps the digest
+    # the same length as the old MD5 hex in the CSV.
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
 
-Article:
-{article[:3000]}
-"""
+def get_model_id():
     if USE_MODEL == "openai":
+        return OPENAI_MODEL
+    elif USE_MODEL == "anthropic":
+        return ANTHROPIC_MODEL
+    return "unknown"
+
+def load_response_cache(filename="sentiment_cache.json"):
+    if os.path.isfile(filename):
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log_message("WARNING", f"Could not read response cache, starting fresh: {e}")
+    return {}
+
+def save_response_cache(cache, filename="sentiment_cache.json"):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+
+def csv_has_todays_article(today, article_hash, filename="market_sentiment.csv"):
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, mode="r", newline="") as file:
+        for row in csv.reader(file):
+            if row and row[0] == today and len(row) > 5 and row[5] == article_hash:
+                return True
+    return False
+
+def get_sentiment(article, model=None):
+    provider = model or USE_MODEL
+    article_prompt = f"Article:\n{article[:3000]}"
+    if provider == "openai":
         completion = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": ANALYST_SYSTEM},
+                {"role": "user", "content": article_prompt}
+            ]
         )
-        return completion.choices[0].message.content.strip(), "gpt-4"
-    elif USE_MODEL == "anthropic":
+        return completion.choices[0].message.content.strip(), OPENAI_MODEL
+    elif provider == "anthropic":
         response = client.messages.create(
-            model="claude-opus-4-20250514",
-            max_tokens=512,
+            model=ANTHROPIC_MODEL,
+            # Output is one word plus 2-3 short indicators; billing and
+            # latency both scale with output tokens, so keep the cap tight.
+            max_tokens=80,
             temperature=0,
-            messages=[{"role": "user", "content": prompt}]
+            system=[{"type": "text", "text": ANALYST_SYSTEM, "cache_control": {"type": "ephemeral"}}],
+            messages=[{"role": "user", "content": article_prompt}]
         )
-        return response.content[0].text.strip(), "claude-opus-4-20250514"
+        log_message("DEBUG", f"Prompt cache read tokens: {getattr(response.usage, 'cache_read_input_tokens', 0)}")
+        return response.content[0].text.strip(), ANTHROPIC_MODEL
     return "Undetermined", "unknown"
 
+# Thin provider-specific wrappers for callers/schedulers that want to pin a
+# provider regardless of the USE_MODEL environment setting.
+def get_sentiment_openai(article):
+    return get_sentiment(article, model="openai")
+
+def get_sentiment_anthropic(article):
+    return get_sentiment(article, model="anthropic")
+
 def clean_sentiment(raw):
     first_word = raw.strip().split()[0].lower().rstrip(".")
     return first_word.capitalize() if first_word in {"bullish", "bearish", "mixed"} else "Undetermined"
 
 def write_log_csv(today, raw_publish, sentiment, model_used, model_version, article_hash, raw_response, filename="market_sentiment.csv"):
-    file_exists = os.path.isfile(filename)
-    rows = []
-
-    if file_exists:
-        with open(filename, mode="r", newline="") as file:
-            rows = list(csv.reader(file))
-
+    # Append-only journal: O(1) I/O per run instead of rewriting the whole
+    # file. A date can appear more than once (e.g. the article changed
+    # intra-day); readers should take the last row per date.
     header = ["today_date", "raw_publish_date", "sentiment", "model", "model_version", "article_hash", "raw_response"]
     log_row = [today, raw_publish, sentiment, model_used, model_version, article_hash, raw_response]
-    updated = False
+    write_header = not os.path.isfile(filename) or os.path.getsize(filename) == 0
 
-    for i, row in enumerate(rows):
-        if row and row[0] == today:
-            rows[i] = log_row
-            updated = True
-            break
+    with open(filename, mode="a", newline="") as file:
+        writer = csv.writer(file)
+        if write_header:
+            writer.writerow(header)
+        writer.writerow(log_row)
 
-    if not updated:
-        if not rows:
-            rows.append(header)
-        rows.append(log_row)
+def fetch_and_parse():
+    # Returns (article, publish_date, raw_publish_str), or None when the
+    # origin answered 304 and there is nothing new to process. On the retry
+    # pass this means an unchanged page costs one conditional request and
+    # zero parsing. Raises ValueError if the publish date cannot be found.
+    html_bytes = fetch_article()
+    if html_bytes is None:
+        return None
+    dump_html(html_bytes)
+    tree = parse_html(html_bytes)
+    article = extract_article_text(tree)
+    log_message("INFO", "Fetched article text successfully.")
+    log_message("DEBUG", "Article text and raw HTML dumped to article.log / article_html.log.")
+    publish_date, raw_publish_str = extract_publish_datetime(html_bytes)
+    log_message("INFO", f"Fetched article published on: {raw_publish_str}")
+    return article, publish_date, raw_publish_str
 
-    with open(filename, mode="w", newline="") as file:
-        csv.writer(file).writerows(rows)
+def check_and_notify(today_str, article, raw_publish_str):
+    article_hash = get_article_hash(article)
+
+    if csv_has_todays_article(today_str, article_hash):
+        log_message("INFO", "Today's entry for this article is already logged. Nothing to do.")
+        return
+
+    # Identical article + model always yields the same answer, so reuse the
+    # stored response instead of paying for a fresh LLM call on re-runs.
+    model_id = get_model_id()
+    cache_key = get_article_hash(article[:3000] + model_id)
+    response_cache = load_response_cache()
+    if cache_key in response_cache:
+        log_message("INFO", "Reusing cached LLM response for unchanged article.")
+        sentiment_raw, model_version = response_cache[cache_key], model_id
+    else:
+        sentiment_raw, model_version = get_sentiment(article)
+        response_cache[cache_key] = sentiment_raw
+        save_response_cache(response_cache)
+
+    sentiment = clean_sentiment(sentiment_raw)
+    write_log_csv(today_str, raw_publish_str, sentiment, USE_MODEL, model_version, article_hash, sentiment_raw)
+    log_message("INFO", f"Sentiment for {today_str}: {sentiment}")
+    log_message("DEBUG", f"Article hash: {article_hash}")
+    log_message("DEBUG", f"Raw response: {sentiment_raw}")
+    log_message("INFO", "Logging complete. Sending push notification...")
+
+    push_message = f"{raw_publish_str} — Sentiment: {sentiment_raw[:400]}\nModel: {model_version}"
+    send_push_notification(push_message)
 
 def main(retry=False):
-    html = fetch_article()
-    article = extract_article_text(html)
-    log_message("INFO", "Fetched article text successfully. Check article.log for details.")
+    # Resolve "today" once per attempt, up front; the retry sleep can cross
+    # midnight and the comparison should use the date the attempt started.
+    today_str = datetime.now().strftime("%Y-%m-%d")
+
     try:
-        publish_date, raw_publish_str = extract_publish_datetime(html)
+        parsed = fetch_and_parse()
     except ValueError as e:
         log_message("WARNING", f"{e}. Retrying in 10 seconds...")
         if not retry:
@@ -176,33 +344,24 @@ def main(retry=False):
         else:
             log_message("ERROR", "Retry failed. Still unable to extract publish date.")
             return
-    log_message("INFO", f"Fetched article published on: {raw_publish_str}")
 
-    today_str = datetime.now().strftime("%Y-%m-%d")
+    if parsed is None:
+        log_message("INFO", "Article unchanged since last fetch (HTTP 304). Nothing to do.")
+        return
+    article, publish_date, raw_publish_str = parsed
 
     if today_str != publish_date:
         msg = f"Article has not been updated today. Publish time: {raw_publish_str}"
         log_message("INFO", msg)
         if not retry:
-            log_message("INFO", "Retrying in 1 minute...")
+            log_message("INFO", "Retrying in 5 minutes...")
             time.sleep(300)
             return main(retry=True)
         else:
             log_message("WARNING", "Retry failed, article still not updated.")
             return
 
-    sentiment_raw, model_version = get_sentiment(article)
-
-    sentiment = clean_sentiment(sentiment_raw)
-    article_hash = get_article_hash(article)
-    write_log_csv(today_str, raw_publish_str, sentiment, USE_MODEL, model_version, article_hash, sentiment_raw)
-    log_message("INFO", f"Sentiment for {today_str}: {sentiment}")
-    log_message("DEBUG", f"Article hash: {article_hash}")
-    log_message("DEBUG", f"Raw response: {sentiment_raw}")
-    log_message("INFO", "Logging complete. Sending push notification...")
-
-    push_message = f"{raw_publish_str} — Sentiment: {sentiment_raw[:400]}\nModel: {model_version}"
-    send_push_notification(push_message)
+    check_and_notify(today_str, article, raw_publish_str)
 
 if __name__ == "__main__":
     main()